@@ -18,6 +18,7 @@
 # - If a dictionary is configured as part of a group, only match once per group
 #   in order of the listed dictionaries
 # - Cache the results of reading a dictionary in self.dict_cache
+# - Cache the dictionary chain built for each conversion in self.conversion_cache
 ##########################################################
 
 import io
@@ -51,6 +52,7 @@ class OpenCC:
         self._dict_chain = list()
         self._dict_chain_data = list()
         self.dict_cache = dict()
+        self.conversion_cache = dict()
         self.resource_getter = resource_getter
         # List of sentence separators from OpenCC PhraseExtract.cpp. None of these separators are allowed as
         # part of a dictionary entry
@@ -121,6 +123,12 @@ class OpenCC:
         if self.conversion is None:
             raise ValueError('conversion is not set')
 
+        if self.conversion in self.conversion_cache:
+            # Reuse the chain built the last time this conversion was used
+            self.conversion_name, self._dict_chain, self._dict_chain_data = self.conversion_cache[self.conversion]
+            self._dict_init_done = True
+            return
+
         self._dict_chain = []
 ##        print(self.conversion)
         config = self.conversion + '.json'
@@ -138,6 +146,7 @@ class OpenCC:
 
         self._dict_chain_data = []
         self._add_dictionaries(self._dict_chain, self._dict_chain_data)
+        self.conversion_cache[self.conversion] = (self.conversion_name, self._dict_chain, self._dict_chain_data)
         self._dict_init_done = True
 
     def _add_dictionaries(self, chain_list, chain_data):
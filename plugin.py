@@ -5,7 +5,19 @@ __license__ = 'GPL 3'
 __copyright__ = '2022, Hopkins'
 
 import re, os.path
+import io
+import functools
+import itertools
+import contextlib
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
 import css_parser
+import xml.etree.ElementTree as ET
+# Sigil's bundled Python includes lxml, external Pythons may not, so fall back to ElementTree
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
 from html.parser import HTMLParser
 from html.entities import name2codepoint
 import sys
@@ -40,18 +52,23 @@ DICT_FILE = 'dictionary'
 PUNC_OMITS = "。、；：！？…‥＿﹏，"
 
 
-# Index into criteria      criteria values
-
-INPUT_SOURCE = 0           # 0=whole book, 1=current file, 2=selected text
-CONVERSION_TYPE = 1        # 0=No change, 1=trad->simp, 2=simp->trad, 3=trad->trad
-INPUT_LOCALE = 2           # 0=Mainland, 1=Hong Kong, 2=Taiwan 3=Japan
-OUTPUT_LOCALE = 3          # 0=Mainland, 1=Hong Kong, 2=Taiwan 3=Japan
-USE_TARGET_PHRASES = 4     # True/False
-QUOTATION_TYPE = 5         # 0=No change, 1=Western, 2=East Asian
-OUTPUT_ORIENTATION = 6     # 0=No change, 1=Horizontal, 2=Vertical
-UPDATE_PUNCTUATION = 7     # True/False
-PUNC_DICT = 8              # punctuation swapping dictionary based on settings, may be None
-PUNC_REGEX = 9             # precompiled regex expression to swap punctuation, may be None
+# The criteria tuple, its fields are read by name      criteria values
+#   input_source                0=whole book, 1=current file, 2=selected text
+#   conversion_type             0=No change, 1=trad->simp, 2=simp->trad, 3=trad->trad
+#   input_locale                0=Mainland, 1=Hong Kong, 2=Taiwan 3=Japan
+#   output_locale               0=Mainland, 1=Hong Kong, 2=Taiwan 3=Japan
+#   use_target_phrases          True/False
+#   quotation_type              0=No change, 1=Western, 2=East Asian
+#   output_orientation          0=No change, 1=Horizontal, 2=Vertical
+#   update_punctuation          True/False
+#   punc_dict                   punctuation swapping dictionary based on settings, may be None
+#   punc_trans                  str.translate table built from punc_dict to swap punctuation, may be None
+#   configuration               OpenCC configuration name, see get_configuration
+#   language_code               output language code, see get_language_code
+Criteria = namedtuple('Criteria', ['input_source', 'conversion_type', 'input_locale', 'output_locale',
+                                   'use_target_phrases', 'quotation_type', 'output_orientation',
+                                   'update_punctuation', 'punc_dict', 'punc_trans', 'configuration',
+                                   'language_code'])
 
 
 #<!--PI_SELTEXT_START-->
@@ -67,6 +84,83 @@ _h2v_master_dict = {'。':'︒', '、':'︑', '；':'︔', '：':'︓', '！':'
         '〔':'︹', '｛':'︷', '〕':'︺', '｝':'︸', '［':'﹇', '］':'﹈', '…':'︙', '‥':'︰', '—':'︱', '＿':'︳',
         '﹏':'︴', '，':'︐'}
 
+# Horizontal <-> vertical punctuation translation tables for the full master dictionary, used as is
+# when no punctuation is omitted. str.maketrans only accepts single character keys, so building both
+# tables here also checks that every mark and its presentation form is one character, which is what
+# lets the punctuation be swapped with str.translate rather than a regular expression
+_v2h_master_dict = {v: k for k, v in _h2v_master_dict.items()}
+_H2V_TABLE = str.maketrans(_h2v_master_dict)
+_V2H_TABLE = str.maketrans(_v2h_master_dict)
+
+@functools.lru_cache(maxsize=8)
+def _build_punc(omits, orientation):
+    # Returns the punctuation swapping dictionary and its str.translate table for the omitted
+    # punctuation (the punc_omits preference string) and output orientation. The preferences only
+    # change when a dialog is closed, so the same pair is reused by every getCriteria call in between
+    # and the omitted marks are only hashed into a set when they change
+    # The returned dictionary is shared and must not be modified
+
+    if not omits:
+        if orientation == 1:
+            return _v2h_master_dict, _V2H_TABLE
+        elif orientation == 2:
+            return _h2v_master_dict, _H2V_TABLE
+
+    # create a dictionary without the keys contained in omits. If every mark is omitted it is empty,
+    # and so is the punctuation dictionary
+    omit_set = frozenset(omits)
+    h2v = {k: v for k, v in _h2v_master_dict.items() if k not in omit_set}
+
+    if orientation == 1:
+        # vertical full width characters to their horizontal presentation forms
+        punc_dict = {v: k for k, v in h2v.items()}
+    elif orientation == 2:
+        punc_dict = h2v
+    else:
+        punc_dict = {}
+
+    # Every key in the punctuation dictionary is a single character, so str.translate can
+    # swap them all in one pass
+    punc_trans = str.maketrans(punc_dict) if punc_dict else None
+    return punc_dict, punc_trans
+
+# Quotation mark swapping translation tables
+TRAD_TO_SIMP_TRANS = str.maketrans({'「':'“', '」':'”', '『':'‘', '』':'’'})
+SIMP_TO_TRAD_TRANS = str.maketrans({'“':'「', '”':'」', '‘':'『', '’':'』'})
+
+# Dublin Core namespace of the OPF metadata elements
+DC_NAMESPACE = 'http://purl.org/dc/elements/1.1/'
+
+# Tag matching every Dublin Core element, used to have lxml only report those while parsing
+DC_TAG = '{' + DC_NAMESPACE + '}*'
+
+# Precompiled regular expression to modify lang attribute
+ZH_RE = re.compile(r'lang=\"zh-\w+\"|lang=\"zh\"', re.IGNORECASE)
+
+# Precompiled regular expression to detect a Chinese dc:language value
+ZH_LANG_RE = re.compile(r'zh(?:-\w+)?', re.IGNORECASE)
+
+# Precompiled regular expression matching any Han character. Every key in the OpenCC dictionaries
+# contains at least one of these (CJK Unified Ideographs, Extension A, Compatibility Ideographs and
+# the supplementary planes holding Extension B onwards), so text without a match cannot be converted
+CJK_RE = re.compile('[\u3400-\u9FFF\uF900-\uFAFF\U00020000-\U0003FFFF]')
+
+# Separator used to join the text nodes of a file into a single string for OpenCC. OpenCC splits its
+# input on whitespace before matching, so no dictionary entry can span two text nodes. U+0001 is not
+# allowed in XML content and is not whitespace, so splitting the converted string back is unambiguous
+TEXT_BATCH_SEPARATOR = '\n\u0001\n'
+
+def convert_batch(converter, texts):
+    # Convert a list of strings with a single call into the converter, such as the text nodes held
+    # back by handle_data. Fall back to one call per string if the separator already appears in one
+    # of them.
+    joined = TEXT_BATCH_SEPARATOR.join(texts)
+    if joined.count(TEXT_BATCH_SEPARATOR) == len(texts) - 1:
+        converted = converter.convert(joined).split(TEXT_BATCH_SEPARATOR)
+        if len(converted) == len(texts):
+            return converted
+    return [converter.convert(text) for text in texts]
+
 
 from plugin_utils import Qt, QtCore, QtGui, QtWidgets, QAction
 from plugin_utils import PluginApplication, iswindows, _t  # , Signal, Slot, loadUi
@@ -115,7 +209,7 @@ class PuncuationDialog(QtWidgets.QDialog):
 
     def setup_ui(self):
         self.punc_setting = {}
-        self.checkbox_dict = {}
+        self.item_dict = {}
 
         # Create layout for entire dialog
         layout = QtWidgets.QVBoxLayout(self)
@@ -140,15 +234,34 @@ class PuncuationDialog(QtWidgets.QDialog):
         self.punctuation_group_box_layout = QtWidgets.QVBoxLayout()
         self.punctuation_group_box.setLayout(self.punctuation_group_box_layout)
 
-        for x in self.punc_dict:
-            str = x + " <-> " + self.punc_dict[x]
-            widget = QtWidgets.QCheckBox(str)
-            self.checkbox_dict[x] = widget
-            self.punctuation_group_box_layout.addWidget(widget)
-            if x in self.prefs['punc_omits']:
-                widget.setChecked(False)
-            else:
-                widget.setChecked(True)
+        # One checkable item per punctuation pair. The check states live in the model, so setting
+        # them all at once needs no per-widget work
+        self.punctuation_model = QtGui.QStandardItemModel(self)
+        omits = set(self.prefs['punc_omits'])
+        for x, vertical in self.punc_dict.items():
+            str = x + " <-> " + vertical
+            item = QtGui.QStandardItem(str)
+            # Not user checkable, so the view leaves every click on the row to _item_clicked, which
+            # toggles the check whether or not the box itself was hit, as a checkbox's label did
+            item.setFlags(Qt.ItemIsEnabled)
+            item.setCheckState(Qt.Unchecked if x in omits else Qt.Checked)
+            self.item_dict[x] = item
+            self.punctuation_model.appendRow(item)
+
+        # Size the view to show every pair so the dialog's scroll area is the only one, as it was when
+        # each pair was its own checkbox
+        self.punctuation_list = QtWidgets.QListView()
+        self.punctuation_list.setModel(self.punctuation_model)
+        self.punctuation_list.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.punctuation_list.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.punctuation_list.setUniformItemSizes(True)
+        self.punctuation_list.clicked.connect(self._item_clicked)
+        self.punctuation_group_box_layout.addWidget(self.punctuation_list)
+        # The row height and frame width depend on the style and font, which are only final once the
+        # dialog and its children are polished
+        self.ensurePolished()
+        self.punctuation_list.setFixedHeight(self.punctuation_list.sizeHintForRow(0) * len(self.item_dict)
+                                             + 2 * self.punctuation_list.frameWidth())
 
 
         self.button_box_settings = QtWidgets.QDialogButtonBox()
@@ -165,61 +278,54 @@ class PuncuationDialog(QtWidgets.QDialog):
 
 
     def savePrefs(self):
-        setting = ""
-        for x in self.puncSettings:
-            setting = setting + x
-        self.prefs['punc_omits'] = setting
+        # Only membership of the omitted marks matters, so the set order is fine
+        self.prefs['punc_omits'] = "".join(self.puncSettings)
 
 
     def _ok_clicked(self):
         self.puncSettings.clear()
         # Loop through and update set of unchecked items
-        for x in self.checkbox_dict.keys():
-            if not self.checkbox_dict[x].isChecked():
+        for x, item in self.item_dict.items():
+            if item.checkState() != Qt.Checked:
                 self.puncSettings.add(x)
         self.savePrefs()
         self.accept()
 
 
+    def _item_clicked(self, index):
+        item = self.punctuation_model.itemFromIndex(index)
+        item.setCheckState(Qt.Unchecked if item.checkState() == Qt.Checked else Qt.Checked)
+
+
+    def set_checkboxes(self, omits):
+        # Check every item except those whose mark is in omits. Nothing is connected to the
+        # model's signals so there is nothing to block, but hold off repainting until all are set
+        self.punctuation_list.setUpdatesEnabled(False)
+        for x, item in self.item_dict.items():
+            item.setCheckState(Qt.Unchecked if x in omits else Qt.Checked)
+        self.punctuation_list.setUpdatesEnabled(True)
+
+
     def _reject_clicked(self):
         # Restore back to values when first opened
         # This will be the same as the preferences
-        ## loop through all checkboxes
-        for x in self.checkbox_dict.keys():
-            self.checkbox_dict[x].blockSignals(True)
-            if x in self.prefs['punc_omits']:
-                self.checkbox_dict[x].setChecked(False)
-            else:
-                self.checkbox_dict[x].setChecked(True)
-            self.checkbox_dict[x].blockSignals(False)
+        self.set_checkboxes(set(self.prefs['punc_omits']))
         self.reject()
 
 
     def _action_clicked(self, button):
         ## Find out which button is pressed
         if button is self.clearall_button:
-            ## loop through all checkboxes and unset
-            for x in self.checkbox_dict.values():
-                x.blockSignals(True)
-                x.setChecked(False)
-                x.blockSignals(False)
+            ## unset all checkboxes
+            self.set_checkboxes(self.item_dict)
 
         elif button is self.setall_button:
-            ## loop through all checkboxes and set
-            for x in self.checkbox_dict.values():
-                x.blockSignals(True)
-                x.setChecked(True)
-                x.blockSignals(False)
+            ## set all checkboxes
+            self.set_checkboxes(())
 
         elif button is self.default_button:
-            ## loop through all checkboxes
-            for x in self.checkbox_dict.keys():
-                self.checkbox_dict[x].blockSignals(True)
-                if x in self.default_omitted_puncuation:
-                    self.checkbox_dict[x].setChecked(False)
-                else:
-                    self.checkbox_dict[x].setChecked(True)
-                self.checkbox_dict[x].blockSignals(False)
+            ## set all checkboxes except the default omitted ones
+            self.set_checkboxes(set(self.default_omitted_puncuation))
 
 class HTML_TextProcessor(HTMLParser):
     """
@@ -229,23 +335,19 @@ class HTML_TextProcessor(HTMLParser):
     def __init__(self, textConvertor = None):
           super().__init__(convert_charrefs=False)
           self.recording = 0
+          # HTMLParser calls back into Python for every token, so the handlers write through a bound
+          # method instead of looking up self.result.append each time. The output is joined once at the end
           self.result = []
+          self.write = self.result.append
+          # Text nodes waiting to be converted, and the slots in self.result held for them
+          self.pending_text = []
+          self.pending_slots = []
           self.textConverter = textConvertor
           self.criteria = None
           self.converting = True
           self.language = None
           self.force_stylesheet = False
 
-          # Create regular expressions to modify quote styles
-          self.trad_to_simp_quotes = {'「':'“', '」':'”', '『':'‘', '』':'’'}
-          self.trad_to_simp_re = re.compile('|'.join(map(re.escape, self.trad_to_simp_quotes)))
-
-          self.simp_to_trad_quotes = {'“':'「', '”':'」', '‘':'『', '’':'』'}
-          self.simp_to_trad_re = re.compile('|'.join(map(re.escape, self.simp_to_trad_quotes)))
-
-          # Create regular expression to modify lang attribute
-          self.zh_re = re.compile(r'lang=\"zh-\w+\"|lang=\"zh\"', re.IGNORECASE)
-
 
     # Use this if one wants to reset the converter
     def setTextConvertor(self, textConvertor):
@@ -256,34 +358,43 @@ class HTML_TextProcessor(HTMLParser):
 
     def replace_quotations(self, data):
         # update quotes if desired
-        if self.criteria[QUOTATION_TYPE] == 1:
+        if self.criteria.quotation_type == 1:
             # traditional to simplified
-            htmlstr_corrected = self.trad_to_simp_re.sub(lambda match: self.trad_to_simp_quotes[match.group(0)], data)
-        elif self.criteria[QUOTATION_TYPE] == 2:
+            htmlstr_corrected = data.translate(TRAD_TO_SIMP_TRANS)
+        elif self.criteria.quotation_type == 2:
             # simplified to traditional
-            htmlstr_corrected = self.simp_to_trad_re.sub(lambda match: self.simp_to_trad_quotes[match.group(0)], data)
+            htmlstr_corrected = data.translate(SIMP_TO_TRAD_TRANS)
         else:
             # no quote changes desired
             htmlstr_corrected = data
         return htmlstr_corrected
 
 
-    # multiple_replace copied from ActiveState http://code.activestate.com/recipes/81330-single-pass-multiple-replace/
-    # Copyright 2001 Xavier Defrang
-    # PSF (Python Software Foundation) license (GPL Compatible)
-    # https://docs.python.org/3/license.html
-    def multiple_replace(self, replace_regex, replace_dict, text):
-      # For each match, look-up corresponding value in dictionary
-      return replace_regex.sub(lambda mo: replace_dict[mo.string[mo.start():mo.end()]], text)
+    def replace_language(self, tag_text, attrs):
+        # Most tags have no lang attribute, so only scan the tag with ZH_RE when the parsed attributes
+        # have one. HTMLParser lowercases attribute names, and ZH_RE also matches names ending in
+        # lang such as xml:lang
+        for name, value in attrs:
+            if name.endswith('lang'):
+                return ZH_RE.sub(self.language, tag_text)
+        return tag_text
 
     def processText(self, data, criteria):
 ##        print("processText:", data)
 ##        print('processText Criteria: ', criteria)
 
         self.criteria = criteria
+
+        # Nothing in the file can change, so skip parsing and rebuilding it
+        if (criteria.conversion_type == 0 and criteria.quotation_type == 0 and criteria.punc_trans is None
+                and self.language is None and not self.force_stylesheet):
+            return data
+
         self.result.clear()
+        self.pending_text.clear()
+        self.pending_slots.clear()
         self.reset()
-        if self.criteria[INPUT_SOURCE] == 2:
+        if self.criteria.input_source == 2:
             # turn off converting until a start comment seen
             self.converting = False
         else:
@@ -292,6 +403,11 @@ class HTML_TextProcessor(HTMLParser):
 ##        print("Feeding in text")
         self.feed(data)
         self.close()
+        if self.pending_text:
+            # Put the converted text nodes into the slots held for them
+            result = self.result
+            for slot, text in zip(self.pending_slots, convert_batch(self.textConverter, self.pending_text)):
+                result[slot] = text
         # return result
         return "".join(self.result)
 
@@ -302,8 +418,8 @@ class HTML_TextProcessor(HTMLParser):
 ##            print("     attr:", attr)
 
         # change language code inside of tags
-        if self.converting and (self.criteria[CONVERSION_TYPE] != 0) and (self.language != None):
-            text = self.zh_re.sub(self.language, self.get_starttag_text())
+        if self.converting and (self.criteria.conversion_type != 0) and (self.language != None):
+            text = self.replace_language(self.get_starttag_text(), attrs)
         else:
             text = self.get_starttag_text()
 
@@ -312,16 +428,16 @@ class HTML_TextProcessor(HTMLParser):
             if "xml:lang" not in attrs_list:
                 text = text[:-1] + f' xml:{self.language}' + ">"
 
-        self.result.append(text)
+        self.write(text)
 
 
         
 
     def handle_endtag(self, tag):
         if tag == "head" and self.force_stylesheet:
-            self.result.append('<link rel="stylesheet" type="text/css" href="./Styles/stylesheet.css"/>')
+            self.write('<link rel="stylesheet" type="text/css" href="./Styles/stylesheet.css"/>')
             # TODO: This assume that the OBPS/*.html and OBPS/Styles/stylesheet.css, the former is not enforced
-        self.result.append("</" + tag + ">")
+        self.write(f"</{tag}>")
 
 ##        print("End tag  :", tag)
 
@@ -332,42 +448,53 @@ class HTML_TextProcessor(HTMLParser):
 ##            print("     attr:", attr)
 
         # change language code inside of tags
-        if (self.criteria[INPUT_SOURCE] == 0) and (self.criteria[CONVERSION_TYPE] != 0) and (self.language != None):
-            self.result.append(self.zh_re.sub(self.language, self.get_starttag_text()))
+        criteria = self.criteria
+        if (criteria.input_source == 0) and (criteria.conversion_type != 0) and (self.language != None):
+            self.write(self.replace_language(self.get_starttag_text(), attrs))
         else:
-            self.result.append(self.get_starttag_text())
+            self.write(self.get_starttag_text())
 
     def handle_data(self, text):
 ##        print("Data     :", text)
 
         if text.isspace():
 ##            print("handle_data is only whitespace")
-            self.result.append(text)
+            self.write(text)
         else:
+            # Read the criteria once per text node rather than on every test below
+            criteria = self.criteria
+            conversion_type, quotation_type = criteria.conversion_type, criteria.quotation_type
+            output_orientation, punc_trans = criteria.output_orientation, criteria.punc_trans
+
             if self.converting:
-                if (self.criteria[OUTPUT_ORIENTATION] == 0) or (self.criteria[OUTPUT_ORIENTATION] == 2):
-                    # Convert quotation marks
-                    if (self.criteria[QUOTATION_TYPE] != 0):
+                # Quotation marks and punctuation are each converted once. The order matters because
+                # the vertical forms of 「」『』 are quotation marks once made horizontal.
+                # criteria.punc_trans is only set if vertical or horizontal change selected
+                if (output_orientation == 1):
+                    # Convert punctuation to horizontal first so the quotation marks it produces are updated
+                    if punc_trans != None:
+                        text = text.translate(punc_trans)
+                    if (quotation_type != 0):
                         text = self.replace_quotations(text)
-
-                # Convert punctuation to vertical or horizontal using provided regular expression
-                # self.criteria[PUNC_REGEX] is only set if vertical or horizontal change selected
-                if self.criteria[PUNC_REGEX] != None:
-                    text = self.multiple_replace(self.criteria[PUNC_REGEX], self.criteria[PUNC_DICT], text)
-
-                if (self.criteria[OUTPUT_ORIENTATION] == 1):
-                    # Convert quotation marks
-                    if (self.criteria[QUOTATION_TYPE] != 0):
+                else:
+                    # Convert quotation marks first so the new ones get their vertical forms
+                    if (quotation_type != 0):
                         text = self.replace_quotations(text)
+                    if punc_trans != None:
+                        text = text.translate(punc_trans)
 
             # Convert text to traditional or simplified if needed
-##            print('handle_data CONVERSION_TYPE criteria = ', self.criteria[CONVERSION_TYPE])
-            if self.criteria[CONVERSION_TYPE] != 0 and self.converting:
-##                print('handle_data calling self.textConverter.convert(text)')
-                self.result.append(self.textConverter.convert(text))
+##            print('handle_data conversion_type criteria = ', conversion_type)
+            if conversion_type != 0 and self.converting and CJK_RE.search(text):
+##                print('handle_data deferring self.textConverter.convert(text)')
+                # Hold the text back so the whole file is converted at once in processText, keeping
+                # its place in the output
+                self.pending_slots.append(len(self.result))
+                self.write(None)
+                self.pending_text.append(text)
             else:
 ##                print('handle_data NOT calling self.textConverter.convert(text)')
-                self.result.append(text)
+                self.write(text)
 
 
     def handle_comment(self, data):
@@ -375,27 +502,27 @@ class HTML_TextProcessor(HTMLParser):
 ##        print('handle_comment stripped data:', data.strip())
 ##        print('seltext_start_tag:', seltext_start_tag)
 ##        print('seltext_end_tag:', seltext_end_tag)
-##        print('handle_comment self.criteria[INPUT_SOURCE]:', self.criteria[INPUT_SOURCE])
-        if (self.criteria[INPUT_SOURCE] == 2) and (data.strip() == seltext_start_tag):
+##        print('handle_comment self.criteria.input_source:', self.criteria.input_source)
+        if (self.criteria.input_source == 2) and (data.strip() == seltext_start_tag):
             self.converting = True
 ##            print('handle_comment converting set to True')
-        elif (self.criteria[INPUT_SOURCE] == 2) and (data.strip() == seltext_end_tag):
+        elif (self.criteria.input_source == 2) and (data.strip() == seltext_end_tag):
             self.converting = False
 ##            print('handle_comment converting set to False')
-        self.result.append("<!--" + data + "-->")
+        self.write(f"<!--{data}-->")
 ##        print("Comment  :", data)
 
     def handle_pi(self, data):
-        self.result.append("<?" + data + ">")
+        self.write(f"<?{data}>")
 ##        print("<?  :", data)
 
     def handle_entityref(self, name):
-        self.result.append("&" + name + ";")
+        self.write(f"&{name};")
 ##        c = chr(name2codepoint[name])
 ##        print("Named ent:", c)
 ##
     def handle_charref(self, name):
-        self.result.append("&#" + name + ";")
+        self.write(f"&#{name};")
 ##        if name.startswith('x'):
 ##            c = chr(int(name[1:], 16))
 ##        else:
@@ -403,22 +530,23 @@ class HTML_TextProcessor(HTMLParser):
 ##        print("Num ent  :", c)
 
     def handle_decl(self, data):
-        self.result.append("<!" + data + ">")
+        self.write(f"<!{data}>")
 ##        print("Decl     :", data)
 
     def unknown_decl(self, data):
-        self.result.append("<!" + data + ">")
+        self.write(f"<!{data}>")
 ##        print("Unknown Decl     :", data)
 
 
 class guiTradSimpChinese(QtWidgets.QMainWindow):
-    def __init__(self, bk):
-        super().__init__()
+    # Shared by every window, OpenCC keeps the dictionaries and conversion chains it has loaded
+    converter = OpenCC(get_resource_file)
 
-        self.converter = OpenCC(get_resource_file)
+    # Create the HTML parser and pass in the converer
+    parser = HTML_TextProcessor(converter)
 
-        # Create the HTML parser and pass in the converer  
-        self.parser = HTML_TextProcessor(self.converter)
+    def __init__(self, bk):
+        super().__init__()
 
         # The Sigil BookContainer
         self.bk = bk
@@ -431,7 +559,8 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
 
         app = PluginApplication.instance()
         self.setWindowTitle(_t('guiTradSimpChinese', 'Chinese Conversion'))
-        self.punctuation_dialog = PuncuationDialog(self.prefs, _h2v_master_dict, PUNC_OMITS)
+        # Created the first time the punctuation settings are opened
+        self.punctuation_dialog = None
 
         self.setup_ui()
 
@@ -498,15 +627,16 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         operation_group_box_layout = QtWidgets.QVBoxLayout()
         self.operation_group_box.setLayout(operation_group_box_layout)
 
+        # Button ids match the conversion_type preference values
         self.operation_group=QtWidgets.QButtonGroup(self)
         self.no_conversion_button = QtWidgets.QRadioButton(_t('guiTradSimpChinese', 'No Conversion'))
-        self.operation_group.addButton(self.no_conversion_button)
+        self.operation_group.addButton(self.no_conversion_button, 0)
         self.trad_to_simp_button = QtWidgets.QRadioButton(_t('guiTradSimpChinese', 'Traditional to Simplified'))
-        self.operation_group.addButton(self.trad_to_simp_button)
+        self.operation_group.addButton(self.trad_to_simp_button, 1)
         self.simp_to_trad_button = QtWidgets.QRadioButton(_t('guiTradSimpChinese', 'Simplified to Traditional'))
-        self.operation_group.addButton(self.simp_to_trad_button)
+        self.operation_group.addButton(self.simp_to_trad_button, 2)
         self.trad_to_trad_button = QtWidgets.QRadioButton(_t('guiTradSimpChinese', 'Traditional to Traditional'))
-        self.operation_group.addButton(self.trad_to_trad_button)
+        self.operation_group.addButton(self.trad_to_trad_button, 3)
         operation_group_box_layout.addWidget(self.no_conversion_button)
         operation_group_box_layout.addWidget(self.trad_to_simp_button)
         operation_group_box_layout.addWidget(self.simp_to_trad_button)
@@ -550,18 +680,30 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         style_group_box_layout.addWidget(self.use_target_phrases)
         self.use_target_phrases.stateChanged.connect(self.update_gui)
 
+        # Input/output combo tooltips for each conversion type, translated once here rather than
+        # on every update_gui call
+        self.combo_tooltips = {
+            0: _t('guiTradSimpChinese', 'Valid input/output combinations:\nNot Applicable'),
+            1: _t('guiTradSimpChinese', 'Valid input/output combinations:\nHong Kong/Mainland\nMainland/Mainland\nTaiwan/Mainland\nMainland/Japan'),
+            2: _t('guiTradSimpChinese', 'Valid input/output combinations:\nMainland/Hong Kong\nMainland/Mainland\nMainland/Taiwan\nJapan/Mainland'),
+            3: _t('guiTradSimpChinese', 'Valid input/output combinations:\nHong Kong/Mainland\nMainland/Hong Kong\nTaiwan/Mainland\nMainland/Taiwan\nMainland/Mainland\nHong Kong/Hong Kong\nTaiwan/Taiwan')}
+        # Widgets that only apply when a conversion is selected
+        self.style_widgets = (self.input_combo, self.output_combo, self.use_target_phrases,
+                              self.output_region_label, self.input_region_label, self.style_group_box)
+
         self.quotation_group_box = QtWidgets.QGroupBox(_t('guiTradSimpChinese', 'Quotation Marks'))
         widgetLayout.addWidget(self.quotation_group_box)
         quotation_group_box_layout = QtWidgets.QVBoxLayout()
         self.quotation_group_box.setLayout(quotation_group_box_layout)
 
-        quotation_group=QtWidgets.QButtonGroup()
+        # Button ids match the quotation_type preference values
+        self.quotation_group=QtWidgets.QButtonGroup(self)
         self.quotation_no_conversion_button = QtWidgets.QRadioButton(_t('guiTradSimpChinese', 'No Conversion'))
-        quotation_group.addButton(self.quotation_no_conversion_button)
+        self.quotation_group.addButton(self.quotation_no_conversion_button, 0)
         self.quotation_trad_to_simp_button = QtWidgets.QRadioButton(self.quote_for_simp_target)
-        quotation_group.addButton(self.quotation_trad_to_simp_button)
+        self.quotation_group.addButton(self.quotation_trad_to_simp_button, 1)
         self.quotation_simp_to_trad_button = QtWidgets.QRadioButton(self.quote_for_trad_target)
-        quotation_group.addButton(self.quotation_simp_to_trad_button)
+        self.quotation_group.addButton(self.quotation_simp_to_trad_button, 2)
         quotation_group_box_layout.addWidget(self.quotation_no_conversion_button)
         quotation_group_box_layout.addWidget(self.quotation_simp_to_trad_button)
         quotation_group_box_layout.addWidget(self.quotation_trad_to_simp_button)
@@ -597,14 +739,15 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         punctuation_layout.addWidget(self.punc_settings_btn)
         self.punc_settings_btn.clicked.connect(self.punc_settings_btn_clicked)
         
-        source_group=QtWidgets.QButtonGroup()
+        # Button ids match the input_source preference values
+        self.source_group=QtWidgets.QButtonGroup(self)
         self.book_source_button = QtWidgets.QRadioButton(_t('guiTradSimpChinese', 'Entire eBook'))
         self.file_source_button = QtWidgets.QRadioButton(_t('guiTradSimpChinese', 'Selected File(s)'))
         self.seltext_source_button = QtWidgets.QRadioButton(_t('guiTradSimpChinese', 'Selected Text in Selected File(s)'))
         self.seltext_source_button.setToolTip(_t('guiTradSimpChinese', '“Selected Text” is bracketed by <!--PI_SELTEXT_START--> and <!--PI_SELTEXT_END-->'))
-        source_group.addButton(self.book_source_button)
-        source_group.addButton(self.file_source_button)
-        source_group.addButton(self.seltext_source_button)
+        self.source_group.addButton(self.book_source_button, 0)
+        self.source_group.addButton(self.file_source_button, 1)
+        self.source_group.addButton(self.seltext_source_button, 2)
         self.source_group_box = QtWidgets.QGroupBox(_t('guiTradSimpChinese', 'Source'))
         if not self.force_entire_book:
             widgetLayout.addWidget(self.source_group_box)
@@ -621,6 +764,16 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         self.button_box.rejected.connect(self._reject_clicked)
         layout.addWidget(self.button_box)
 
+        # Message box and progress text used after OK is clicked, translated once here
+        self.message_text = {
+            'no_changes_title': _t('guiTradSimpChinese', "No Changes"),
+            'unsupported': _t('guiTradSimpChinese', "The output configuration selected is not supported.\n Please use a different Input/Output Language Styles combination"),
+            'failed_title': _t('guiTradSimpChinese', "Failed"),
+            'failed': _t('guiTradSimpChinese', 'Failed to convert Chinese, click "Show details" for more info'),
+            'changed_title': _t('guiTradSimpChinese', "Changed Files"),
+            'no_changes': _t('guiTradSimpChinese', "No text meeting your criteria was found to change.\nNo changes made."),
+            'converting': _t('guiTradSimpChinese', 'Converting')}
+
         self.set_to_preferences()
         self.update_gui()
 
@@ -628,84 +781,45 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
 
 
     def on_op_button_clicked(self, btn):
-        self.block_signals(True)
-        if btn == self.no_conversion_button:
-            self.input_combo.setCurrentIndex(-1)  # blank out the entry
-            self.output_combo.setCurrentIndex(-1) # blank out the entry
-        else:
-            self.input_combo.setCurrentIndex(0)   # mainland
-            self.output_combo.setCurrentIndex(0)  # mainland
-        self.block_signals(False)
+        with self.signals_blocked():
+            if btn == self.no_conversion_button:
+                self.input_combo.setCurrentIndex(-1)  # blank out the entry
+                self.output_combo.setCurrentIndex(-1) # blank out the entry
+            else:
+                self.input_combo.setCurrentIndex(0)   # mainland
+                self.output_combo.setCurrentIndex(0)  # mainland
         self.update_gui()
 
-    def block_signals(self, state):
-        # block or unblock the signals generated by these objects to avoid recursive calls
-        self.input_combo.blockSignals(state)
-        self.output_combo.blockSignals(state)
-        self.no_conversion_button.blockSignals(state)
-        self.trad_to_simp_button.blockSignals(state)
-        self.simp_to_trad_button.blockSignals(state)
-        self.trad_to_trad_button.blockSignals(state)
-        self.file_source_button.blockSignals(state)
-        self.seltext_source_button.blockSignals(state)
-        self.book_source_button.blockSignals(state)
-        self.quotation_trad_to_simp_button.blockSignals(state)
-        self.quotation_simp_to_trad_button.blockSignals(state)
-        self.quotation_no_conversion_button.blockSignals(state)
-        self.text_dir_combo.blockSignals(state)
-        self.update_punctuation.blockSignals(state)
+    @contextlib.contextmanager
+    def signals_blocked(self):
+        # block the signals generated by these objects to avoid recursive calls. The QSignalBlockers
+        # restore each object's previous state on exit, even if an exception is raised in between
+        with contextlib.ExitStack() as stack:
+            for widget in (self.input_combo, self.output_combo, self.no_conversion_button,
+                           self.trad_to_simp_button, self.simp_to_trad_button, self.trad_to_trad_button,
+                           self.file_source_button, self.seltext_source_button, self.book_source_button,
+                           self.quotation_trad_to_simp_button, self.quotation_simp_to_trad_button,
+                           self.quotation_no_conversion_button, self.text_dir_combo, self.update_punctuation):
+                stack.enter_context(QtCore.QSignalBlocker(widget))
+            yield
 
     def update_gui(self):
         # callback to update other gui items when one changes
-        if self.no_conversion_button.isChecked():
-            self.input_combo.setEnabled(False)
-            self.output_combo.setEnabled(False)
-            self.input_combo.setToolTip(_t('guiTradSimpChinese', 'Valid input/output combinations:\nNot Applicable'))
-            self.output_combo.setToolTip(_t('guiTradSimpChinese', 'Valid input/output combinations:\nNot Applicable'))
-            self.use_target_phrases.setEnabled(False)
-            self.output_region_label.setEnabled(False)
-            self.input_region_label.setEnabled(False)
-            self.style_group_box.setEnabled(False)
-
-        elif self.trad_to_simp_button.isChecked():
-            self.input_combo.setEnabled(True)
-            self.output_combo.setEnabled(True)
-            self.use_target_phrases.setEnabled(True)
-            self.output_region_label.setEnabled(True)
-            self.input_region_label.setEnabled(True)
-            self.input_combo.setToolTip(_t('guiTradSimpChinese', 'Valid input/output combinations:\nHong Kong/Mainland\nMainland/Mainland\nTaiwan/Mainland\nMainland/Japan'))
-            self.output_combo.setToolTip(_t('guiTradSimpChinese', 'Valid input/output combinations:\nHong Kong/Mainland\nMainland/Mainland\nTaiwan/Mainland\nMainland/Japan'))
-            self.style_group_box.setEnabled(True)
-
-        elif self.simp_to_trad_button.isChecked():
-            self.input_combo.setEnabled(True)
-            self.output_combo.setEnabled(True)
-            self.input_combo.setToolTip(_t('guiTradSimpChinese', 'Valid input/output combinations:\nMainland/Hong Kong\nMainland/Mainland\nMainland/Taiwan\nJapan/Mainland'))
-            self.output_combo.setToolTip(_t('guiTradSimpChinese', 'Valid input/output combinations:\nMainland/Hong Kong\nMainland/Mainland\nMainland/Taiwan\nJapan/Mainland'))
-            self.use_target_phrases.setEnabled(True)
-            self.output_region_label.setEnabled(True)
-            self.input_region_label.setEnabled(True)
-            self.style_group_box.setEnabled(True)
-
-        elif self.trad_to_trad_button.isChecked():
-            self.input_combo.setEnabled(True)
-            self.output_combo.setEnabled(True)
-            self.input_combo.setToolTip(_t('guiTradSimpChinese', 'Valid input/output combinations:\nHong Kong/Mainland\nMainland/Hong Kong\nTaiwan/Mainland\nMainland/Taiwan\nMainland/Mainland\nHong Kong/Hong Kong\nTaiwan/Taiwan'))
-            self.output_combo.setToolTip(_t('guiTradSimpChinese', 'Valid input/output combinations:\nHong Kong/Mainland\nMainland/Hong Kong\nTaiwan/Mainland\nMainland/Taiwan\nMainland/Mainland\nHong Kong/Hong Kong\nTaiwan/Taiwan'))
-            self.use_target_phrases.setEnabled(True)
-            self.output_region_label.setEnabled(True)
-            self.input_region_label.setEnabled(True)
-            self.style_group_box.setEnabled(True)
-
-        if self.text_dir_combo.currentIndex() == 0:
-            self.update_punctuation.blockSignals(True)
-            self.update_punctuation.setChecked(False)
-            self.update_punctuation.setEnabled(False)
-            self.update_punctuation.blockSignals(False)
-        else:
-            self.update_punctuation.blockSignals(True)
-            self.update_punctuation.setEnabled(True)
-            self.update_punctuation.blockSignals(False)
+        conversion_type = self.operation_group.checkedId()
+        if conversion_type in self.combo_tooltips:
+            enabled = conversion_type != 0
+            for widget in self.style_widgets:
+                widget.setEnabled(enabled)
+            tooltip = self.combo_tooltips[conversion_type]
+            self.input_combo.setToolTip(tooltip)
+            self.output_combo.setToolTip(tooltip)
+
+        with QtCore.QSignalBlocker(self.update_punctuation):
+            if self.text_dir_combo.currentIndex() == 0:
+                self.update_punctuation.setChecked(False)
+                self.update_punctuation.setEnabled(False)
+            else:
+                self.update_punctuation.setEnabled(True)
 
         if self.update_punctuation.isChecked():
             self.punc_settings_btn.setEnabled(True)
@@ -714,94 +828,51 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
 
     def direction_changed(self):
         # callback when text direction changes
-        self.update_punctuation.blockSignals(True)
-        self.punc_settings_btn.blockSignals(True)
+        with QtCore.QSignalBlocker(self.update_punctuation), QtCore.QSignalBlocker(self.punc_settings_btn):
+            if self.text_dir_combo.currentIndex() == 0:    # no direction change
+                self.update_punctuation.setChecked(False)
+                self.update_punctuation.setEnabled(False)
+                self.punc_settings_btn.setEnabled(False)
 
-        if self.text_dir_combo.currentIndex() == 0:    # no direction change
-            self.update_punctuation.setChecked(False)
-            self.update_punctuation.setEnabled(False)
-            self.punc_settings_btn.setEnabled(False)
-
-        else:
-            self.update_punctuation.setChecked(True)
-            self.update_punctuation.setEnabled(True)
-            self.punc_settings_btn.setEnabled(True)
-
-        self.punc_settings_btn.blockSignals(False)
-        self.update_punctuation.blockSignals(False)
+            else:
+                self.update_punctuation.setChecked(True)
+                self.update_punctuation.setEnabled(True)
+                self.punc_settings_btn.setEnabled(True)
 
     def set_to_preferences(self):
         # set the gui values to match those in the preferences
-        self.block_signals(True)
-
-        self.input_combo.setCurrentIndex(self.prefs['input_locale'])
-        self.output_combo.setCurrentIndex(self.prefs['output_locale'])
+        with self.signals_blocked():
+            self.input_combo.setCurrentIndex(self.prefs['input_locale'])
+            self.output_combo.setCurrentIndex(self.prefs['output_locale'])
 
-        if self.prefs['conversion_type'] == 0:
-            self.no_conversion_button.setChecked(True)
-        elif self.prefs['conversion_type'] == 1:
-            self.trad_to_simp_button.setChecked(True)
-        elif self.prefs['conversion_type'] == 2:
-            self.simp_to_trad_button.setChecked(True)
-        else:
-            self.trad_to_trad_button.setChecked(True)
+            # The groups are exclusive, so checking the button with the preference's id unchecks the rest.
+            # A stored value with no matching button falls back to the same default as before
+            (self.operation_group.button(self.prefs['conversion_type']) or self.trad_to_trad_button).setChecked(True)
 
-        if not self.force_entire_book:
-            if self.prefs['input_source'] == 1:
-                self.file_source_button.setChecked(True)
-            elif self.prefs['input_source'] == 2:
-                self.seltext_source_button.setChecked(True)
+            if not self.force_entire_book:
+                (self.source_group.button(self.prefs['input_source']) or self.book_source_button).setChecked(True)
             else:
                 self.book_source_button.setChecked(True)
-        else:
-            self.book_source_button.setChecked(True)
-            self.file_source_button.setChecked(False)
-            self.seltext_source_button.setChecked(False)
-
-        if self.prefs['quotation_type'] == 1:
-            self.quotation_trad_to_simp_button.setChecked(True)
-        elif self.prefs['quotation_type'] == 2:
-            self.quotation_simp_to_trad_button.setChecked(True)
-        else:
-            self.quotation_no_conversion_button.setChecked(True)
 
-        self.text_dir_combo.setCurrentIndex(self.prefs['output_orientation'])
-        if self.text_dir_combo.currentIndex() == 0:
-            self.update_punctuation.setChecked(False)
-        else:
-            self.update_punctuation.setChecked(self.prefs['update_punctuation'])
+            (self.quotation_group.button(self.prefs['quotation_type']) or self.quotation_no_conversion_button).setChecked(True)
+
+            self.text_dir_combo.setCurrentIndex(self.prefs['output_orientation'])
+            if self.text_dir_combo.currentIndex() == 0:
+                self.update_punctuation.setChecked(False)
+            else:
+                self.update_punctuation.setChecked(self.prefs['update_punctuation'])
 
-        self.block_signals(False)
 
     def savePrefs(self):
         # save the current settings into the preferences
         self.prefs['input_locale'] = self.input_combo.currentIndex()
         self.prefs['output_locale'] = self.output_combo.currentIndex()
 
-        if self.trad_to_simp_button.isChecked():
-            self.prefs['conversion_type'] = 1
-        elif self.simp_to_trad_button.isChecked():
-            self.prefs['conversion_type'] = 2
-        elif self.trad_to_trad_button.isChecked():
-            self.prefs['conversion_type'] = 3
-        else:
-            self.prefs['conversion_type'] = 0
-
-        if self.file_source_button.isChecked():
-            self.prefs['input_source'] = 1
-        elif self.seltext_source_button.isChecked():
-            self.prefs['input_source'] = 2
-        else:
-            self.prefs['input_source'] = 0
-
+        # checkedId() is -1 if no button is checked, store 0 (no conversion, entire book) then as before
+        self.prefs['conversion_type'] = max(self.operation_group.checkedId(), 0)
+        self.prefs['input_source'] = max(self.source_group.checkedId(), 0)
         self.prefs['use_target_phrases'] = self.use_target_phrases.isChecked()
-
-        if self.quotation_trad_to_simp_button.isChecked():
-            self.prefs['quotation_type'] = 1
-        elif self.quotation_simp_to_trad_button.isChecked():
-            self.prefs['quotation_type'] = 2
-        else:
-            self.prefs['quotation_type'] = 0
+        self.prefs['quotation_type'] = max(self.quotation_group.checkedId(), 0)
 
         self.prefs['output_orientation'] = self.text_dir_combo.currentIndex()
         self.prefs['update_punctuation'] = self.update_punctuation.isChecked()
@@ -827,20 +898,24 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         # self.boss.add_savepoint(_('Before: Text Conversion')) #checkpoint support for plugin is not available in Sigil
 
         # Set the conversion output language
-        self.language = get_language_code(criteria)
+        self.language = criteria.language_code
         if self.language != "None":
             self.parser.setLanguageAttribute('lang=\"' + self.language + '\"')
         else:
             self.parser.setLanguageAttribute(None)
 
         try:
-            conversion = get_configuration(criteria)
+            conversion = criteria.configuration
     ##                print("Conversion: ", conversion);
             if conversion == 'unsupported_conversion':
                 dlg = QtWidgets.QMessageBox(icon = QtWidgets.QMessageBox.Warning)
-                dlg.setWindowTitle(_t('guiTradSimpChinese', "No Changes"))
-                dlg.setText(_t('guiTradSimpChinese', "The output configuration selected is not supported.\n Please use a different Input/Output Language Styles combination"))
+                dlg.setWindowTitle(self.message_text['no_changes_title'])
+                dlg.setText(self.message_text['unsupported'])
                 dlg.exec()
+            elif conversion == 'no_conversion' and criteria.quotation_type == 0 and criteria.output_orientation == 0:
+                # Nothing in the book would change, so skip reading and parsing every file and
+                # report that no changes were made
+                pass
             else:
                 QtWidgets.QApplication.setOverrideCursor(QtGui.QCursor(Qt.WaitCursor))
                 QtWidgets.QApplication.processEvents()
@@ -852,8 +927,8 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
             # Something bad happened report the error to the user
             import traceback
             dlg = QtWidgets.QMessageBox(icon = QtWidgets.QMessageBox.Critical)
-            dlg.setWindowTitle(_t('guiTradSimpChinese', "Failed"))
-            dlg.setText(_t('guiTradSimpChinese', 'Failed to convert Chinese, click "Show details" for more info'))
+            dlg.setWindowTitle(self.message_text['failed_title'])
+            dlg.setText(self.message_text['failed'])
             dlg.setDetailedText(traceback.format_exc())
             dlg.exec()
 
@@ -862,19 +937,19 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         else:
             if self.filesChanged:
                 dlg = QtWidgets.QMessageBox()
-                dlg.setWindowTitle(_t('guiTradSimpChinese', "Changed Files"))
+                dlg.setWindowTitle(self.message_text['changed_title'])
                 dlg.setText(f"A total of {len(self.changed_files)} files have been converted.")
                 dlg.exec()
                 self.close()
             elif conversion != 'unsupported_conversion':
                 dlg = QtWidgets.QMessageBox(icon = QtWidgets.QMessageBox.Information)
-                dlg.setWindowTitle(_t('guiTradSimpChinese', "No Changes"))
-                dlg.setText(_t('guiTradSimpChinese', "No text meeting your criteria was found to change.\nNo changes made."))
+                dlg.setWindowTitle(self.message_text['no_changes_title'])
+                dlg.setText(self.message_text['no_changes'])
                 dlg.exec()
 
     def process_files(self, criteria):
 
-        if criteria[INPUT_SOURCE] == 1 or criteria[INPUT_SOURCE] == 2:
+        if criteria.input_source == 1 or criteria.input_source == 2:
             for (typ, ident) in self.bk.selected_iter():
                 # Skip the ones that aren't the "Text" mimetype.
                 if self.bk.id_to_mime(ident) != 'application/xhtml+xml':
@@ -891,26 +966,26 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
                     self.changed_files.append(href)
                     self.bk.writefile(ident, htmlstr)
 
-        elif criteria[INPUT_SOURCE] == 0:
+        elif criteria.input_source == 0:
 
             # Cover the entire book
             # Set metadata and Table of Contents (TOC) if language changed
-            if criteria[CONVERSION_TYPE] != 0:
+            if criteria.conversion_type != 0:
                 self.filesChanged = self.set_metadata_toc(criteria)
 
-            if criteria[OUTPUT_ORIENTATION] != 0 and len(list(self.bk.css_iter())) == 0:
+            if criteria.output_orientation != 0 and len(list(self.bk.css_iter())) == 0:
                 self.filesChanged = True
                 self.bk.addfile("css", "stylesheet.css", "")
                 self.parser.force_stylesheet = True
 
-            dlg = ShowProgressDialog(self.bk, criteria, self.parser.processText, _t('guiTradSimpChinese', 'Converting'))
+            dlg = ShowProgressDialog(self.bk, criteria, self.parser.processText, self.message_text['converting'])
             self.changed_files.extend(dlg.changed_files)
 
             self.parser.force_stylesheet = False
 
             # Check for orientation change
             direction_changed = False
-            if criteria[OUTPUT_ORIENTATION] != 0:
+            if criteria.output_orientation != 0:
                 direction_changed = set_flow_direction(self.bk, criteria, self.changed_files, self.converter)
 
             self.filesChanged = self.filesChanged or (not dlg.clean) or direction_changed
@@ -923,36 +998,20 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         # The preference set is updated every time the user dialog is closed
 
         punc_dict = {}
-        punc_regex = None
-
-        if self.prefs['update_punctuation'] and (len(self.prefs['punc_omits']) != len(_h2v_master_dict.keys())):
-            # create a dictionary without the keys contained in self.prefs['punc_omits']
-            h2v = {}
-            omit_set = set(self.prefs['punc_omits'])
-            for key in _h2v_master_dict.keys():
-                if not key in omit_set:
-                    h2v[key] = _h2v_master_dict[key]
-
-            # horizontal full width characters to their vertical presentation forms regex
-            h2v_dict_regex = re.compile("(%s)" % "|".join(map(re.escape, h2v.keys())))
-
-            # vertical full width characters to their horizontal presentation forms regex
-            v2h = {v: k for k, v in h2v.items()}
-            v2h_dict_regex = re.compile("(%s)" % "|".join(map(re.escape, v2h.keys())))
-
-            if self.prefs['output_orientation'] == 1:
-                punc_dict = v2h
-                punc_regex = v2h_dict_regex
-            elif self.prefs['output_orientation'] == 2:
-                punc_dict = h2v
-                punc_regex = h2v_dict_regex
-
-        criteria = (
+        punc_trans = None
+
+        if self.prefs['update_punctuation']:
+            punc_dict, punc_trans = _build_punc(self.prefs['punc_omits'], self.prefs['output_orientation'])
+
+        criteria = Criteria(
             self.prefs['input_source'], self.prefs['conversion_type'], self.prefs['input_locale'],
             self.prefs['output_locale'], self.prefs['use_target_phrases'], self.prefs['quotation_type'],
-            self.prefs['output_orientation'], self.prefs['update_punctuation'], punc_dict, punc_regex)
+            self.prefs['output_orientation'], self.prefs['update_punctuation'], punc_dict, punc_trans,
+            None, None)
 
-        return criteria
+        # Decode the conversion and output language once, callers read them from the criteria
+        return criteria._replace(configuration=get_configuration(criteria),
+                                 language_code=get_language_code(criteria))
     
     def set_metadata_toc(self, criteria):
     # Returns True if either the metadata or TOC files changed
@@ -965,18 +1024,28 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         # Add more items to this list if needed
         # '//opf:metadata/dc:title'
 
-        dc_list = ['title', 'description', 'publisher', 'subject' 'contributor', 'coverage', 'rights']
-        
-        import xml.etree.ElementTree as ET
-        tree = ET.ElementTree(ET.fromstring(self.bk.getmetadataxml()))
-        root = tree.getroot()
+        dc_list = ['title', 'description', 'publisher', 'subject', 'contributor', 'coverage', 'rights']
 
-        for item in root.iter():
-            _, *tag = item.tag.split("}")
-            tag = tag[0] if tag else None
+        # Parse bytes so neither parser rejects the encoding declaration
+        metadata_xml = self.bk.getmetadataxml()
+        if isinstance(metadata_xml, str):
+            metadata_xml = metadata_xml.encode('utf-8')
+
+        if etree is not None:
+            # The whole tree is still built so it can be written back, but only the Dublin Core
+            # elements are handed to Python as they finish parsing
+            context = etree.iterparse(io.BytesIO(metadata_xml), events=('end',), tag=DC_TAG)
+            dc_items = ((etree.QName(item).localname, item) for event, item in context)
+        else:
+            root = ET.fromstring(metadata_xml)
+            dc_prefix = '{' + DC_NAMESPACE + '}'
+            dc_items = ((item.tag[len(dc_prefix):], item) for item in root.iter()
+                        if item.tag.startswith(dc_prefix))
+
+        for tag, item in dc_items:
 
             # Only update the dc language if the original language was a Chinese type and epub format
-            if tag == "language" and (re.search('zh-\w+|zh', item.text, flags=re.IGNORECASE) != None):
+            if tag == "language" and (ZH_LANG_RE.search(item.text) != None):
                 old_text = item.text
                 item.text = self.language
                 if item.text != old_text:
@@ -989,8 +1058,12 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
                     item.text = self.converter.convert(item.text)
                     if item.text != old_text:
                         metadataChanged = True
-                for attrib in item.attrib:
-                    item.attrib[attrib] = self.converter.convert(item.attrib[attrib])
+                # Convert all the attribute values (file-as and friends) in one go
+                names = list(item.attrib.keys())
+                attribs = dict(zip(names, convert_batch(self.converter, [item.attrib[name] for name in names])))
+                if attribs != dict(item.attrib):
+                    item.attrib.update(attribs)
+                    metadataChanged = True
 
             elif tag in dc_list:
                 old_text = item.text
@@ -999,6 +1072,8 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
                     if item.text != old_text:
                         metadataChanged = True
 
+        if etree is not None:
+            root = context.root
 
         tocid = self.bk.gettocid()
         href = self.bk.id_to_href(tocid)
@@ -1006,12 +1081,9 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         if not isinstance(data, str):
             data = str(data, 'utf-8')
 
-        dummy_criteria = list(criteria)
-        dummy_criteria[OUTPUT_ORIENTATION] = 0
-
         htmlstr = self.parser.processText(data, criteria)
         if htmlstr != data:
-            self.tocChanged = True
+            tocChanged = True
             self.changed_files.append(href)
             self.bk.writefile(tocid, htmlstr)
 
@@ -1036,24 +1108,19 @@ class guiTradSimpChinese(QtWidgets.QMainWindow):
         # Update the files with the changes
 
         if metadataChanged:
-            xml_str = ET.tostring(root, encoding='unicode')
+            xml_str = (etree or ET).tostring(root, encoding='unicode')
             self.bk.setmetadataxml(xml_str)
 
         return(tocChanged or metadataChanged)
 
     def punc_settings_btn_clicked(self):
         # open the punctuation dialog
+        if self.punctuation_dialog is None:
+            self.punctuation_dialog = PuncuationDialog(self.prefs, _h2v_master_dict, PUNC_OMITS)
         self.punctuation_dialog.exec()
 
-def get_language_code(criteria):
-    """
-    :param criteria: the description of the desired conversion
-    :return: 'zh-CN', 'zh-TW', 'zh-HK', or 'None'
-    """
-    conversion_mode = criteria[CONVERSION_TYPE]
-    input_type = criteria[INPUT_LOCALE]
-    output_type = criteria[OUTPUT_LOCALE]
-
+def _lookup_language_code(conversion_mode, input_type, output_type):
+    # Builds _LANG_TABLE, and answers any combination missing from it, see get_language_code
     # Return 'None' if Japan locale is used so that no laguage changes are made
     language_code = 'None'
 
@@ -1099,37 +1166,47 @@ def get_language_code(criteria):
             language_code = 'None'
     return language_code
 
+# Language code for every (conversion type, input locale, output locale), built once from the branches above.
+# Locale -1 is the blanked out combo box left by selecting No Conversion
+_LANG_TABLE = {key: _lookup_language_code(*key) for key in itertools.product(range(4), range(-1, 4), range(-1, 4))}
 
-def add_flow_direction_properties(rule, orientation_value, break_value):
-    rule_changed = False
-    if rule.style['writing-mode'] != orientation_value:
-        rule.style['writing-mode'] = orientation_value
-        rule_changed = True
+def get_language_code(criteria):
+    """
+    :param criteria: the description of the desired conversion
+    :return: 'zh-CN', 'zh-TW', 'zh-HK', or 'None'
+    """
+    key = (criteria.conversion_type, criteria.input_locale, criteria.output_locale)
+    language_code = _LANG_TABLE.get(key)
+    if language_code is None:
+        language_code = _lookup_language_code(*key)
+    return language_code
 
-    if rule.style['-epub-writing-mode'] != orientation_value:
-        rule.style['-epub-writing-mode'] = orientation_value
-        rule_changed = True
 
-    if rule.style['-webkit-writing-mode'] != orientation_value:
-        rule.style['-webkit-writing-mode'] = orientation_value
-        rule_changed = True
+# CSS properties set to the orientation value and to the line break value respectively
+_FLOW_PROPS = ('writing-mode', '-epub-writing-mode', '-webkit-writing-mode')
+_LINE_BREAK_PROPS = ('line-break', '-webkit-line-break')
 
-    if rule.style['line-break'] != break_value:
-        rule.style['line-break'] = break_value
-        rule_changed = True
+def add_flow_direction_properties(rule, orientation_value, break_value):
+    rule_changed = False
+    style = rule.style
+    for prop in _FLOW_PROPS:
+        if style[prop] != orientation_value:
+            style[prop] = orientation_value
+            rule_changed = True
 
-    if rule.style['-webkit-line-break'] != break_value:
-        rule.style['-webkit-line-break'] = break_value
-        rule_changed = True
+    for prop in _LINE_BREAK_PROPS:
+        if style[prop] != break_value:
+            style[prop] = break_value
+            rule_changed = True
 
     return rule_changed
 
 def set_flow_direction(bk, criteria, changed_files, converter):
     # Open OPF and set flow
     flow = 'default'
-    if criteria[OUTPUT_ORIENTATION] == 2:
+    if criteria.output_orientation == 2:
         flow = 'rtl'
-    elif criteria[OUTPUT_ORIENTATION] == 1:
+    elif criteria.output_orientation == 1:
         flow = 'ltr'
 
     old_flow = bk.getspine_ppd()
@@ -1137,48 +1214,52 @@ def set_flow_direction(bk, criteria, changed_files, converter):
     fileChanged = (old_flow != flow)
 
     # Open CSS and set layout direction in the body section
-    if criteria[OUTPUT_ORIENTATION] == 1:
+    if criteria.output_orientation == 1:
         orientation = 'horizontal-tb'
         break_rule = 'auto'
-    if criteria[OUTPUT_ORIENTATION] == 2:
+    if criteria.output_orientation == 2:
         orientation = 'vertical-rl'
         break_rule = 'normal'
 
     addedCSSRules = False
 
-    for id, href in bk.css_iter():
-        data = bk.readfile(id)
-        sheet = css_parser.parseString(data)
+    # Parse every stylesheet once, each pass below works on the same parsed sheets. A pass only runs
+    # if the earlier ones found no rule to update, so no pass sees another's changes
+    sheets = [(id, href, css_parser.parseString(bk.readfile(id))) for id, href in bk.css_iter()]
+
+    for id, href, sheet in sheets:
+        sheetChanged = False
         rules = (rule for rule in sheet if rule.type == rule.STYLE_RULE)
         for rule in rules:
             for selector in rule.selectorList:
                 if selector.selectorText == u'.calibre':
                     addedCSSRules = True
                     if add_flow_direction_properties(rule, orientation, break_rule):
-                        fileChanged = True
-                        changed_files.append(href)
-                        bk.writefile(id, sheet.cssText)
+                        sheetChanged = True
                     break
+        if sheetChanged:
+            fileChanged = True
+            changed_files.append(href)
+            bk.writefile(id, sheet.cssText)
 
     if not addedCSSRules:
-        for id, href in bk.css_iter():
-            data = bk.readfile(id)
-            sheet = css_parser.parseString(data)
+        for id, href, sheet in sheets:
+            sheetChanged = False
             rules = (rule for rule in sheet if rule.type == rule.STYLE_RULE)
             for rule in rules:
                 for selector in rule.selectorList:
                     if selector.selectorText == u'body':
                         addedCSSRules = True
                         if add_flow_direction_properties(rule, orientation, break_rule):
-                            fileChanged = True
-                            changed_files.append(href)
-                            bk.writefile(id, sheet.cssText)
+                            sheetChanged = True
+            if sheetChanged:
+                fileChanged = True
+                changed_files.append(href)
+                bk.writefile(id, sheet.cssText)
 
     # If no 'body' selector rule is found in any css file, add one to every css file
     if not addedCSSRules:
-        for id, href in bk.css_iter():
-            data = bk.readfile(id)
-            sheet = css_parser.parseString(data)
+        for id, href, sheet in sheets:
             # Create a style rule for body.
             styleEntry = css_parser.css.CSSStyleDeclaration()
             styleEntry['writing-mode'] = orientation
@@ -1193,41 +1274,8 @@ def set_flow_direction(bk, criteria, changed_files, converter):
             bk.writefile(id, sheet.cssText)
     return fileChanged
 
-def add_flow_direction_properties(rule, orientation_value, break_value):
-    rule_changed = False
-    if rule.style['writing-mode'] != orientation_value:
-        rule.style['writing-mode'] = orientation_value
-        rule_changed = True
-
-    if rule.style['-epub-writing-mode'] != orientation_value:
-        rule.style['-epub-writing-mode'] = orientation_value
-        rule_changed = True
-
-    if rule.style['-webkit-writing-mode'] != orientation_value:
-        rule.style['-webkit-writing-mode'] = orientation_value
-        rule_changed = True
-
-    if rule.style['line-break'] != break_value:
-        rule.style['line-break'] = break_value
-        rule_changed = True
-
-    if rule.style['-webkit-line-break'] != break_value:
-        rule.style['-webkit-line-break'] = break_value
-        rule_changed = True
-
-    return rule_changed
-
-def get_configuration(criteria):
-    """
-    :param criteria: the description of the desired conversion
-    :return a tuple of the conversion direction and the output format:
-      1) 'hk2s', 'hk2t', 'jp2t', 's2hk', 's2t', 's2tw', 's2twp', 't2hk', 't2hkp', 't2jp', 't2s', 't2tw', 'tw2s', 'tw2sp', 'tw2t', 'no_conversion', or 'unsupported_conversion'
-    """
-    conversion_mode = criteria[CONVERSION_TYPE]
-    input_type = criteria[INPUT_LOCALE]
-    output_type = criteria[OUTPUT_LOCALE]
-    use_target_phrasing = criteria[USE_TARGET_PHRASES]
-
+def _lookup_configuration(conversion_mode, input_type, output_type, use_target_phrasing):
+    # Builds _CONFIG_TABLE, and answers any combination missing from it, see get_configuration
     configuration = 'unsupported_conversion'
 
     if conversion_mode == 0:
@@ -1317,33 +1365,65 @@ def get_configuration(criteria):
 
     return configuration
 
+# OpenCC configuration for every (conversion type, input locale, output locale, use target phrases),
+# built once from the branches above. Locale -1 is the blanked out combo box left by selecting No Conversion
+_CONFIG_TABLE = {key: _lookup_configuration(*key)
+                 for key in itertools.product(range(4), range(-1, 4), range(-1, 4), (False, True))}
+
+def get_configuration(criteria):
+    """
+    :param criteria: the description of the desired conversion
+    :return a tuple of the conversion direction and the output format:
+      1) 'hk2s', 'hk2t', 'jp2t', 's2hk', 's2t', 's2tw', 's2twp', 't2hk', 't2hkp', 't2jp', 't2s', 't2tw', 'tw2s', 'tw2sp', 'tw2t', 'no_conversion', or 'unsupported_conversion'
+    """
+    key = (criteria.conversion_type, criteria.input_locale, criteria.output_locale, bool(criteria.use_target_phrases))
+    configuration = _CONFIG_TABLE.get(key)
+    if configuration is None:
+        configuration = _lookup_configuration(*key)
+    return configuration
+
 
 class ShowProgressDialog(QtWidgets.QProgressDialog):
+    # Number of files read ahead on the worker thread while the current file is being converted
+    PREFETCH_COUNT = 2
+
     def __init__(self, bk, criteria, callback_fn, action_type='Checking'):
-        self.file_list = list(bk.text_iter())
+        # Walk the text files lazily, only counting them up front for the progress bar
+        self.file_iter = iter(bk.text_iter())
         self.clean = True
         self.changed_files = []
-        self.total_count = len(self.file_list)
+        self.total_count = sum(1 for _ in bk.text_iter())
         super().__init__('', _t("ShowProgressDialog", 'Cancel'), 0, self.total_count)
         self.setMinimumWidth(500)
         self.bk, self.criteria, self.callback_fn, self.action_type = bk, criteria, callback_fn, action_type
         self.setWindowTitle('{0}...'.format(self.action_type))
         self.i = 0
-        
+
+        # Reads are handed to one worker thread so the next files come off the disk while the
+        # current one is converted. Conversion and writes stay on this thread
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.prefetched = deque()
+        self.prefetch()
+
         QtCore.QTimer.singleShot(0, self.do_action)
         self.exec()
 
+    def prefetch(self):
+        # keep up to PREFETCH_COUNT reads queued ahead of the file being converted
+        for id, href in itertools.islice(self.file_iter, self.PREFETCH_COUNT - len(self.prefetched)):
+            self.prefetched.append((id, href, self.pool.submit(self.bk.readfile, id)))
+
     def do_action(self):
 
         if self.wasCanceled():
             return self.do_close()
-        if self.i >= self.total_count:
+        if not self.prefetched:
             return self.do_close()
 
-        id, href = self.file_list[self.i]
-
-        data = self.bk.readfile(id)
+        id, href, future = self.prefetched.popleft()
+        data = future.result()
         self.i += 1
+        self.prefetch()
 
         self.setLabelText('{0}: {1}'.format(self.action_type, href))
         # Send the necessary data to the callback function in main.py.
@@ -1359,6 +1439,11 @@ class ShowProgressDialog(QtWidgets.QProgressDialog):
         QtCore.QTimer.singleShot(0, self.do_action)
 
     def do_close(self):
+        # drop any reads still queued after a cancel
+        for id, href, future in self.prefetched:
+            future.cancel()
+        self.prefetched.clear()
+        self.pool.shutdown(wait=True)
         self.close()
 
 def run(bk):